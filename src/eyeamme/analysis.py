@@ -4,17 +4,29 @@ Excel file analysis module.
 TODO: Replace the analyze_excel function with your actual analysis logic.
 """
 import pandas as pd
-from typing import Dict, Any
+from typing import BinaryIO, Dict, Any, Union
 
+# Prefer calamine (Rust-backed, much faster than openpyxl). Without it, keep
+# openpyxl in read-only/data-only mode so it streams cells instead of
+# building the full style and formula tree.
+try:
+    import python_calamine  # noqa: F401
 
-def analyze_excel(file_path: str) -> Dict[str, Any]:
+    EXCEL_ENGINE = "calamine"
+    EXCEL_ENGINE_KWARGS: Dict[str, Any] = {}
+except ImportError:
+    EXCEL_ENGINE = "openpyxl"
+    EXCEL_ENGINE_KWARGS = {"read_only": True, "data_only": True}
+
+
+def analyze_excel(excel_file: Union[str, BinaryIO]) -> Dict[str, Any]:
     """
     Analyze an Excel file and return results.
 
     This is a PLACEHOLDER function. Replace this with your actual analysis logic.
 
     Args:
-        file_path: Path to the Excel file to analyze
+        excel_file: Path to the Excel file, or a binary file-like object
 
     Returns:
         Dictionary containing analysis results
@@ -47,8 +59,21 @@ def analyze_excel(file_path: str) -> Dict[str, Any]:
     }
     """
     try:
-        # Read the Excel file
-        df = pd.read_excel(file_path)
+        # Open the workbook once and reuse it for sheet names and data.
+        # The sheet is parsed in a single pass: the preview tail and the
+        # statistics need every row, so extra nrows/skiprows reads would
+        # only decode the sheet again.
+        with pd.ExcelFile(
+            excel_file, engine=EXCEL_ENGINE, engine_kwargs=EXCEL_ENGINE_KWARGS
+        ) as xl:
+            sheet_names = xl.sheet_names
+            df = xl.parse(sheet_names[0])
+
+        # Arrow-backed columns keep a validity bitmap instead of NaN
+        # sentinels, which makes the numeric reductions cheaper. Only the
+        # numeric columns are converted: mixed-type columns stay as objects.
+        numeric_columns = df.select_dtypes(include=["number"]).columns
+        df[numeric_columns] = df[numeric_columns].convert_dtypes(dtype_backend="pyarrow")
 
         # ==========================================
         # TODO: REPLACE THIS WITH YOUR ANALYSIS CODE
@@ -61,12 +86,12 @@ def analyze_excel(file_path: str) -> Dict[str, Any]:
                 "total_columns": len(df.columns),
                 "columns": df.columns.tolist(),
                 "file_info": {
-                    "sheet_names": pd.ExcelFile(file_path).sheet_names,
+                    "sheet_names": sheet_names,
                 }
             },
             "data_preview": {
-                "first_5_rows": df.head().to_dict(orient="records"),
-                "last_5_rows": df.tail().to_dict(orient="records"),
+                "first_5_rows": df.iloc[:5].to_dict(orient="records"),
+                "last_5_rows": df.iloc[max(0, len(df) - 5):].to_dict(orient="records"),
             },
             "statistics": {},
             "insights": [
@@ -76,16 +101,15 @@ def analyze_excel(file_path: str) -> Dict[str, Any]:
             ],
         }
 
-        # Add basic statistics for numeric columns
-        numeric_columns = df.select_dtypes(include=['number']).columns
-        for col in numeric_columns:
-            result["statistics"][col] = {
-                "mean": float(df[col].mean()),
-                "median": float(df[col].median()),
-                "min": float(df[col].min()),
-                "max": float(df[col].max()),
-                "std": float(df[col].std()),
-            }
+        # Add basic statistics for numeric columns (one describe() pass)
+        numeric_df = df.select_dtypes(include=['number'])
+        if len(numeric_df.columns) > 0:
+            description = numeric_df.describe(percentiles=[0.5])
+            result["statistics"] = (
+                description.rename(index={"50%": "median"})
+                .loc[["mean", "median", "min", "max", "std"]]
+                .to_dict()
+            )
 
         # ==========================================
         # END OF PLACEHOLDER CODE
@@ -106,50 +130,10 @@ def analyze_excel(file_path: str) -> Dict[str, Any]:
         }
 
 
-# Additional helper functions for your analysis (optional)
-
-def validate_excel_structure(df: pd.DataFrame, expected_columns: list) -> bool:
+def warm_up() -> None:
     """
-    Validate that the Excel file has the expected structure.
+    Prepare a worker process for analysis.
 
-    Args:
-        df: Pandas DataFrame
-        expected_columns: List of expected column names
-
-    Returns:
-        True if structure is valid, False otherwise
+    Running this in a worker imports this module, and with it pandas and the
+    Excel engine, so the first real analysis doesn't pay for the imports.
     """
-    return all(col in df.columns for col in expected_columns)
-
-
-def calculate_custom_metric(df: pd.DataFrame, column: str) -> float:
-    """
-    Example: Calculate a custom metric on a specific column.
-
-    Args:
-        df: Pandas DataFrame
-        column: Column name
-
-    Returns:
-        Calculated metric value
-    """
-    # Replace with your custom calculation
-    return df[column].sum()
-
-
-def generate_insights(df: pd.DataFrame) -> list:
-    """
-    Generate insights from the data.
-
-    Args:
-        df: Pandas DataFrame
-
-    Returns:
-        List of insight strings
-    """
-    insights = []
-
-    # Example: Add insights based on your analysis
-    # insights.append(f"Total revenue: ${df['revenue'].sum():,.2f}")
-
-    return insights
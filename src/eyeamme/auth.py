@@ -1,29 +1,55 @@
 """
 Authentication module for user management and JWT tokens.
 """
-from datetime import datetime, timedelta
-from typing import Optional
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
+import asyncio
+import time
 import uuid
 
+from cachetools import LRUCache, TTLCache
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
-from .storage import save_json_to_r2, load_json_from_r2
-from .config import Settings
-settings = Settings()
+from .storage import (
+    save_json_to_r2,
+    load_json_from_r2,
+    load_json_with_etag_from_r2,
+    save_json_to_r2_if_match,
+    users_index_key,
+    user_profile_key,
+    LEGACY_USERS_INDEX_KEY,
+)
+from .config import get_settings
+settings = get_settings()
 
 # Configuration
 SECRET_KEY = settings.secret_key
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
+USERS_INDEX_MAX_RETRIES = 5
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing: new hashes use argon2id, existing bcrypt hashes still verify
+pwd_context = CryptContext(schemes=["argon2", "bcrypt"], deprecated="auto")
 
+# Short-lived caches in front of R2 for the per-request user lookups
+USER_CACHE_TTL_SECONDS = 60
+user_profile_cache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL_SECONDS)
+user_id_cache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL_SECONDS)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+# Recently verified tokens, so repeat requests skip the signature check.
+# Entries carry the token's own expiry, so they need no separate TTL.
+TOKEN_CACHE_SIZE = 4096
+token_cache = LRUCache(maxsize=TOKEN_CACHE_SIZE)
+
+# Email -> user ID from the unsharded users index. It is no longer written,
+# so it is loaded once and kept in memory.
+legacy_users: Optional[Dict[str, str]] = None
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """Verify a password, returning a new hash if the stored one uses a deprecated scheme."""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
 
 
 def get_password_hash(password: str) -> str:
@@ -43,10 +69,11 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -
         Encoded JWT token
     """
     to_encode = data.copy()
+    now = datetime.now(timezone.utc)
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = now + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
+        expire = now + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
 
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
@@ -63,16 +90,88 @@ def decode_access_token(token: str) -> Optional[str]:
     Returns:
         User ID if token is valid, None otherwise
     """
+    cached = token_cache.get(token)
+    if cached is not None:
+        user_id, expires_at = cached
+        return user_id if time.time() < expires_at else None
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         user_id: str = payload.get("sub")
         if user_id is None:
             return None
+        token_cache[token] = (user_id, payload["exp"])
         return user_id
     except JWTError:
         return None
 
 
+async def load_legacy_users() -> Dict[str, str]:
+    """
+    Load the unsharded users index kept for users registered before sharding.
+
+    Returns:
+        Dictionary mapping emails to user IDs, empty if there is no index
+    """
+    global legacy_users
+    if legacy_users is not None:
+        return legacy_users
+
+    # Not cached when missing, as a failed download also returns None
+    legacy_index = await load_json_from_r2(LEGACY_USERS_INDEX_KEY)
+    if legacy_index is None:
+        return {}
+
+    legacy_users = legacy_index["users"]
+    return legacy_users
+
+
+async def get_user_id_by_email(email: str) -> Optional[str]:
+    """
+    Look up a user ID in the users index.
+
+    Args:
+        email: User's email address
+
+    Returns:
+        User ID if registered, None otherwise
+    """
+    user_id = user_id_cache.get(email)
+    if user_id is not None:
+        return user_id
+
+    users_index = await load_json_from_r2(users_index_key(email))
+    if users_index is not None and email in users_index["users"]:
+        user_id = users_index["users"][email]
+    else:
+        # Users registered before the index was sharded
+        user_id = (await load_legacy_users()).get(email)
+
+    if user_id is not None:
+        user_id_cache[email] = user_id
+    return user_id
+
+
+async def load_user_profile(user_id: str) -> Optional[dict]:
+    """
+    Load a user's stored profile, including the password hash.
+
+    Args:
+        user_id: User's unique identifier
+
+    Returns:
+        Stored profile dictionary if found, None otherwise
+    """
+    user_data = user_profile_cache.get(user_id)
+    if user_data is not None:
+        return user_data
+
+    user_data = await load_json_from_r2(user_profile_key(user_id))
+    if user_data is not None:
+        user_profile_cache[user_id] = user_data
+    return user_data
+
+
 async def create_user(email: str, password: str, full_name: str) -> str:
     """
     Create a new user account.
@@ -86,39 +185,48 @@ async def create_user(email: str, password: str, full_name: str) -> str:
         User ID
 
     Raises:
-        ValueError: If user already exists
+        ValueError: If user already exists or the users index kept changing
     """
     # Check if user already exists
-    # We'll use a simple approach: try to load users index
-    users_index_key = "users/index.json"
-    users_index = await load_json_from_r2(users_index_key)
-
-    if users_index is None:
-        users_index = {"users": {}}
-
-    # Check if email already exists
-    if email in users_index["users"]:
+    if await get_user_id_by_email(email) is not None:
         raise ValueError("User with this email already exists")
 
     # Generate user ID
     user_id = str(uuid.uuid4())
 
+    # Hash off the event loop; the KDF is deliberately slow
+    hashed_password = await asyncio.to_thread(get_password_hash, password)
+
+    # Claim the email in its index shard, retrying if a concurrent
+    # registration updated the shard since we read it
+    index_key = users_index_key(email)
+    for _ in range(USERS_INDEX_MAX_RETRIES):
+        users_index, etag = await load_json_with_etag_from_r2(index_key)
+        if users_index is None:
+            users_index = {"users": {}}
+
+        if email in users_index["users"]:
+            raise ValueError("User with this email already exists")
+
+        users_index["users"][email] = user_id
+        if await save_json_to_r2_if_match(index_key, users_index, etag):
+            break
+    else:
+        raise ValueError("Could not register user, please try again")
+
     # Create user profile
     user_data = {
         "user_id": user_id,
         "email": email,
         "full_name": full_name,
-        "hashed_password": get_password_hash(password),
-        "created_at": datetime.utcnow().isoformat(),
+        "hashed_password": hashed_password,
+        "created_at": datetime.now(timezone.utc).isoformat(),
     }
 
     # Save user profile
-    user_profile_key = f"users/{user_id}/profile.json"
-    await save_json_to_r2(user_profile_key, user_data)
-
-    # Update users index
-    users_index["users"][email] = user_id
-    await save_json_to_r2(users_index_key, users_index)
+    await save_json_to_r2(user_profile_key(user_id), user_data)
+    user_profile_cache[user_id] = user_data
+    user_id_cache[email] = user_id
 
     return user_id
 
@@ -134,26 +242,30 @@ async def authenticate_user(email: str, password: str) -> Optional[dict]:
     Returns:
         User data dictionary if authentication successful, None otherwise
     """
-    # Load users index
-    users_index_key = "users/index.json"
-    users_index = await load_json_from_r2(users_index_key)
-
-    if users_index is None or email not in users_index["users"]:
+    # Look up user in the users index
+    user_id = await get_user_id_by_email(email)
+    if user_id is None:
         return None
 
-    user_id = users_index["users"][email]
-
     # Load user profile
-    user_profile_key = f"users/{user_id}/profile.json"
-    user_data = await load_json_from_r2(user_profile_key)
+    user_data = await load_user_profile(user_id)
 
     if user_data is None:
         return None
 
-    # Verify password
-    if not verify_password(password, user_data["hashed_password"]):
+    # Verify password off the event loop
+    verified, new_hash = await asyncio.to_thread(
+        verify_and_update_password, password, user_data["hashed_password"]
+    )
+    if not verified:
         return None
 
+    # Upgrade legacy bcrypt hashes so later logins skip bcrypt
+    if new_hash is not None:
+        user_data = {**user_data, "hashed_password": new_hash}
+        await save_json_to_r2(user_profile_key(user_id), user_data)
+        user_profile_cache[user_id] = user_data
+
     # Return user data (without password hash)
     return {
         "user_id": user_data["user_id"],
@@ -173,8 +285,7 @@ async def get_user_by_id(user_id: str) -> Optional[dict]:
     Returns:
         User data dictionary if found, None otherwise
     """
-    user_profile_key = f"users/{user_id}/profile.json"
-    user_data = await load_json_from_r2(user_profile_key)
+    user_data = await load_user_profile(user_id)
 
     if user_data is None:
         return None
@@ -1,8 +1,16 @@
-from pydantic_settings import BaseSettings
+from functools import cached_property, lru_cache
+from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import List
 
 
 class Settings(BaseSettings):
+    model_config = SettingsConfigDict(
+        case_sensitive=False,
+        env_file=".env",
+        extra="ignore",
+        frozen=True,
+    )
+
     # Security
     secret_key: str
     algorithm: str = "hs256"
@@ -20,17 +28,25 @@ class Settings(BaseSettings):
 
     # encryption
     encryption_key: str
+    # Off stores objects with R2 server-side encryption only. The key is
+    # still needed to read objects that were encrypted client-side.
+    client_side_encryption: bool = True
 
     # cors
     allowed_origins: str = "http://localhost:3000"
 
     log_level: str | int = "INFO"
 
-    @property
+    # Server
+    web_concurrency: int = 1
+    run_scheduler: bool = True
+
+    @cached_property
     def allowed_origins_list(self) -> List[str]:
         return [origin.strip() for origin in self.allowed_origins.split(",")]
 
-    class Config:
-        case_sensitive = False
-        env_file = ".env"
-        extra = 'ignore'
+
+@lru_cache
+def get_settings() -> Settings:
+    """Load settings once and reuse them for the lifetime of the process."""
+    return Settings()
@@ -1,32 +1,44 @@
 """
 Excel Analysis System - Main FastAPI Application
 """
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request, Form
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Request, Response, Form
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+import asyncio
 import os
-from datetime import datetime
-import uuid
+import time
+from datetime import datetime, timezone
 
 from .auth import (
     create_user,
     authenticate_user,
     create_access_token,
     decode_access_token,
+    get_user_by_id,
 )
 from .storage import (
+    open_r2_client,
+    close_r2_client,
     upload_file_to_r2,
-    download_file_from_r2,
-    delete_file_from_r2,
+    delete_user_file,
     list_user_files,
     save_json_to_r2,
     load_json_from_r2,
+    new_file_id,
+    file_prefix,
+    file_metadata_key,
+    file_report_key,
 )
-from .analysis import analyze_excel
+from .analysis import analyze_excel, warm_up
+from .models import FileUploadResponse
 from .scheduler import start_scheduler
+from .config import get_settings
+settings = get_settings()
 
 # Initialize FastAPI app
 app = FastAPI(
@@ -41,6 +53,27 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 security = HTTPBearer(auto_error=False)
 
+# Accepted upload extensions
+EXCEL_EXTENSIONS = (".xlsx", ".xls")
+
+# Worker processes for Excel analysis, so parsing doesn't block the event loop.
+# The cores are shared between all web workers.
+ANALYSIS_WORKERS = max(1, (os.cpu_count() or 1) // settings.web_concurrency)
+analysis_executor = ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS)
+
+
+# Current time as an ISO string, formatted at most once per second
+cached_now_iso = (0, "")
+
+
+def utc_now_iso() -> str:
+    """Get the current UTC time as an ISO string, to the second."""
+    global cached_now_iso
+    now = int(time.time())
+    if now != cached_now_iso[0]:
+        cached_now_iso = (now, datetime.fromtimestamp(now, timezone.utc).isoformat())
+    return cached_now_iso[1]
+
 
 # Helper function to get user from cookie
 def get_user_from_cookie(request: Request) -> Optional[str]:
@@ -83,7 +116,7 @@ async def dashboard_page(request: Request, user_id: str = Depends(require_auth))
     """Dashboard with file upload and list."""
     try:
         # Get user info
-        user_data = await load_json_from_r2(f"users/{user_id}/profile.json")
+        user_data = await get_user_by_id(user_id)
 
         # Get user's files
         files = await list_user_files(user_id)
@@ -107,7 +140,7 @@ async def report_page(
     """View analysis report."""
     try:
         # Get report
-        report_key = f"users/{user_id}/files/{file_id}/report.json"
+        report_key = file_report_key(user_id, file_id)
         report = await load_json_from_r2(report_key)
 
         if not report:
@@ -176,12 +209,13 @@ async def logout():
 @app.post("/api/upload")
 async def upload_file(
     request: Request,
+    response: Response,
     file: UploadFile = File(...),
     user_id: str = Depends(require_auth),
 ):
     """Upload and analyze Excel file."""
     # Validate file type
-    if not file.filename.endswith((".xlsx", ".xls")):
+    if not file.filename.endswith(EXCEL_EXTENSIONS):
         return templates.TemplateResponse(
             "dashboard.html",
             {
@@ -193,67 +227,74 @@ async def upload_file(
         )
 
     try:
-        # Generate unique file ID
-        file_id = str(uuid.uuid4())
-        file_key = f"users/{user_id}/files/{file_id}/{file.filename}"
+        # Generate unique file ID from the same timestamp as the upload date,
+        # so both name the same day
+        now = datetime.now(timezone.utc).replace(microsecond=0)
+        now_iso = now.isoformat()
+        file_id = new_file_id(now)
+        file_key = f"{file_prefix(user_id, file_id)}{file.filename}"
 
         # Read file content
         file_content = await file.read()
 
-        # Upload encrypted file to R2
-        await upload_file_to_r2(file_key, file_content)
+        # Upload encrypted file to R2 alongside the analysis
+        upload_task = asyncio.create_task(upload_file_to_r2(file_key, file_content))
 
-        # Create metadata
+        # Create metadata; its final status is only known after the analysis
         metadata = {
             "file_id": file_id,
             "filename": file.filename,
             "user_id": user_id,
-            "upload_date": datetime.utcnow().isoformat(),
+            "upload_date": now_iso,
             "file_size": len(file_content),
-            "status": "processing",
             "file_key": file_key,
         }
-
-        # Save metadata
-        metadata_key = f"users/{user_id}/files/{file_id}/metadata.json"
-        await save_json_to_r2(metadata_key, metadata)
+        report = None
 
         # Analyze file
         try:
-            # Download file to temporary location for analysis
-            temp_file_path = f"/tmp/{file_id}_{file.filename}"
-            decrypted_content = await download_file_from_r2(file_key)
-            with open(temp_file_path, "wb") as f:
-                f.write(decrypted_content)
-
-            # Run analysis
-            analysis_result = analyze_excel(temp_file_path)
-
-            # Clean up temp file
-            os.remove(temp_file_path)
+            # Run analysis in a worker process, straight from memory
+            loop = asyncio.get_running_loop()
+            analysis_result = await loop.run_in_executor(
+                analysis_executor, analyze_excel, BytesIO(file_content)
+            )
 
             # Create report
             report = {
                 "file_id": file_id,
                 "filename": file.filename,
-                "analysis_date": datetime.utcnow().isoformat(),
+                "analysis_date": now_iso,
                 "results": analysis_result,
             }
 
-            # Save report
-            report_key = f"users/{user_id}/files/{file_id}/report.json"
-            await save_json_to_r2(report_key, report)
-
-            # Update metadata status
             metadata["status"] = "completed"
-            metadata["analysis_date"] = report["analysis_date"]
-            await save_json_to_r2(metadata_key, metadata)
+            metadata["analysis_date"] = now_iso
 
         except Exception as e:
-            # Update metadata status to failed
             metadata["status"] = "failed"
             metadata["error"] = str(e)
-            await save_json_to_r2(metadata_key, metadata)
+
+        finally:
+            if not await upload_task:
+                metadata["status"] = "failed"
+                metadata["error"] = "Could not store the file"
+
+        # Save the metadata, which is written once with its final status and
+        # relies on R2 server-side encryption, and the report if the file
+        # was stored and analyzed
+        writes = [
+            save_json_to_r2(file_metadata_key(user_id, file_id), metadata, encrypt=False)
+        ]
+        if metadata["status"] == "completed":
+            writes.append(save_json_to_r2(file_report_key(user_id, file_id), report))
+        await asyncio.gather(*writes)
+
+        # API clients get the metadata right away instead of fetching it again
+        if "application/json" in request.headers.get("accept", ""):
+            if metadata["status"] == "completed":
+                return FileUploadResponse(message="File uploaded successfully", **metadata)
+            response.status_code = 500
+            return FileUploadResponse(message="File upload failed", **metadata)
 
         # Redirect back to dashboard
         return RedirectResponse(url="/dashboard", status_code=302)
@@ -276,22 +317,16 @@ async def delete_file_endpoint(
 ):
     """Delete a file."""
     try:
-        # Get metadata first
-        metadata_key = f"users/{user_id}/files/{file_id}/metadata.json"
-        metadata = await load_json_from_r2(metadata_key)
-
-        if not metadata:
+        # Delete the file, its metadata and its report
+        deleted = await delete_user_file(user_id, file_id)
+        if deleted is None:
             raise HTTPException(status_code=404, detail="File not found")
-
-        # Delete all associated files
-        file_key = metadata["file_key"]
-        report_key = f"users/{user_id}/files/{file_id}/report.json"
-
-        await delete_file_from_r2(file_key)
-        await delete_file_from_r2(metadata_key)
-        await delete_file_from_r2(report_key)
+        if not deleted:
+            raise HTTPException(status_code=500, detail="Could not delete the file")
 
         return RedirectResponse(url="/dashboard", status_code=302)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -302,21 +337,41 @@ async def health_check():
     """Health check endpoint."""
     return {
         "status": "healthy",
-        "timestamp": datetime.utcnow().isoformat(),
+        "timestamp": utc_now_iso(),
     }
 
 
 # Start scheduler on startup
 @app.on_event("startup")
 async def startup_event():
-    """Start background tasks."""
-    start_scheduler()
-    print("✅ Scheduler started - Data retention cleanup active")
+    """Open the R2 client and start background tasks."""
+    # Start the analysis workers up front, so the first uploads don't wait
+    # for them to start and import pandas
+    for _ in range(ANALYSIS_WORKERS):
+        analysis_executor.submit(warm_up)
+
+    await open_r2_client()
+    if start_scheduler():
+        print("✅ Scheduler started - Data retention cleanup active")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop background workers and close the R2 client."""
+    analysis_executor.shutdown(wait=False, cancel_futures=True)
+    await close_r2_client()
 
 
 def main():
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "eyeamme.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=settings.web_concurrency,
+        loop="uvloop",
+        http="httptools",
+    )
 
 if __name__ == "__main__":
     main()
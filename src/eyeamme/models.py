@@ -46,13 +46,10 @@ class FileMetadata(BaseModel):
     error: Optional[str] = None
 
 
-class FileUploadResponse(BaseModel):
-    """Model for file upload response."""
+class FileUploadResponse(FileMetadata):
+    """Model for file upload response, carrying the full file metadata."""
 
     message: str
-    file_id: str
-    filename: str
-    status: str
 
 
 class FileListResponse(BaseModel):
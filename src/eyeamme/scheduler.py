@@ -1,16 +1,32 @@
 """
 Scheduled tasks for data retention and cleanup.
 """
-from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, timedelta
-import os
+from datetime import datetime, timedelta, timezone
 import asyncio
-
-from .storage import list_user_files, delete_user_file, get_all_user_ids
+import fcntl
+import os
+import tempfile
+
+from .config import get_settings
+from .storage import (
+    DELETE_BATCH_SIZE,
+    FILE_DATE_FORMAT,
+    delete_objects_from_r2,
+    file_metadata_key,
+    file_upload_day,
+    get_all_user_ids,
+    list_user_file_keys,
+    load_json_from_r2,
+)
 
 # Configuration
-DATA_RETENTION_DAYS = int(os.getenv("DATA_RETENTION_DAYS", "60"))
+DATA_RETENTION_DAYS = get_settings().data_retention_days
+
+# Held by the one worker process that runs the scheduler
+SCHEDULER_LOCK_PATH = os.path.join(tempfile.gettempdir(), "eyeamme-scheduler.lock")
+scheduler_lock = None
 
 
 async def cleanup_old_files():
@@ -23,17 +39,43 @@ async def cleanup_old_files():
     - Analysis reports
 
     for all files older than DATA_RETENTION_DAYS.
+
+    Files are listed by key only. Their upload day is part of the file ID,
+    so metadata is loaded only for older files stored without one. Expired
+    keys are collected across users and deleted in full DeleteObjects batches.
     """
     print(f"🧹 Starting data retention cleanup (retention: {DATA_RETENTION_DAYS} days)...")
 
     try:
         # Calculate cutoff date
-        cutoff_date = datetime.utcnow() - timedelta(days=DATA_RETENTION_DAYS)
+        cutoff_date = datetime.now(timezone.utc) - timedelta(days=DATA_RETENTION_DAYS)
         cutoff_date_str = cutoff_date.isoformat()
+        cutoff_day = cutoff_date.strftime(FILE_DATE_FORMAT)
 
         deleted_count = 0
         error_count = 0
 
+        # Expired keys waiting to be deleted, and how many files they make up
+        pending_keys = []
+        pending_count = 0
+
+        async def flush_pending():
+            nonlocal deleted_count, error_count, pending_keys, pending_count
+            if not pending_keys:
+                return
+
+            success = await delete_objects_from_r2(pending_keys)
+
+            if success:
+                deleted_count += pending_count
+                print(f"  ✅ Deleted {pending_count} files")
+            else:
+                error_count += 1
+                print(f"  ❌ Failed to delete some of {pending_count} files")
+
+            pending_keys = []
+            pending_count = 0
+
         # Get all user IDs
         user_ids = await get_all_user_ids()
         print(f"📋 Checking files for {len(user_ids)} users...")
@@ -41,32 +83,36 @@ async def cleanup_old_files():
         # Check files for each user
         for user_id in user_ids:
             try:
-                # Get all files for this user
-                files = await list_user_files(user_id)
-
-                # Delete files older than retention period
-                for file_metadata in files:
-                    upload_date_str = file_metadata.get("upload_date", "")
-
-                    if upload_date_str < cutoff_date_str:
-                        file_id = file_metadata["file_id"]
-                        filename = file_metadata.get("filename", "unknown")
-
-                        success = await delete_user_file(user_id, file_id)
-
-                        if success:
-                            deleted_count += 1
-                            print(
-                                f"  ✅ Deleted: {filename} (uploaded: {upload_date_str[:10]})"
-                            )
-                        else:
-                            error_count += 1
-                            print(f"  ❌ Failed to delete: {filename}")
+                # Get the keys of all files for this user
+                file_keys = await list_user_file_keys(user_id)
+
+                # Collect files older than retention period
+                for file_id, keys in file_keys.items():
+                    upload_day = file_upload_day(file_id)
+
+                    if upload_day is None:
+                        # Older file ID without an upload day, check its metadata
+                        metadata_key = file_metadata_key(user_id, file_id)
+                        file_metadata = await load_json_from_r2(metadata_key)
+                        if file_metadata is None:
+                            continue
+                        expired = file_metadata.get("upload_date", "") < cutoff_date_str
+                    else:
+                        expired = upload_day < cutoff_day
+
+                    if expired:
+                        pending_keys.extend(keys)
+                        pending_count += 1
+
+                if len(pending_keys) >= DELETE_BATCH_SIZE:
+                    await flush_pending()
 
             except Exception as e:
                 print(f"  ⚠️  Error processing files for user {user_id}: {e}")
                 error_count += 1
 
+        await flush_pending()
+
         # Summary
         print(f"\n📊 Cleanup Summary:")
         print(f"  - Files deleted: {deleted_count}")
@@ -79,27 +125,45 @@ async def cleanup_old_files():
         print(f"❌ Error during cleanup: {e}")
 
 
-def run_cleanup_sync():
-    """Synchronous wrapper for async cleanup function."""
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
+def acquire_scheduler_lock() -> bool:
+    """
+    Take the scheduler lock, which is held for the lifetime of the process.
+
+    Returns:
+        True if this process now holds the lock, False if another one does
+    """
+    global scheduler_lock
+    lock_file = open(SCHEDULER_LOCK_PATH, "w")
     try:
-        loop.run_until_complete(cleanup_old_files())
-    finally:
-        loop.close()
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+
+    scheduler_lock = lock_file
+    return True
 
 
-def start_scheduler():
+def start_scheduler() -> bool:
     """
     Start the background scheduler for data retention.
 
-    The cleanup job runs daily at midnight UTC.
+    The cleanup job runs daily at midnight UTC on the event loop this is
+    called from. With several worker processes only the first one to take
+    the scheduler lock runs it, and RUN_SCHEDULER can turn it off entirely
+    (e.g. on all but one host).
+
+    Returns:
+        True if the scheduler was started in this process
     """
-    scheduler = BackgroundScheduler()
+    if not get_settings().run_scheduler or not acquire_scheduler_lock():
+        return False
+
+    scheduler = AsyncIOScheduler()
 
     # Schedule daily cleanup at midnight UTC
     scheduler.add_job(
-        run_cleanup_sync,
+        cleanup_old_files,
         trigger=CronTrigger(hour=0, minute=0),  # Daily at 00:00 UTC
         id="data_retention_cleanup",
         name="Data Retention Cleanup",
@@ -108,7 +172,7 @@ def start_scheduler():
 
     # Optional: Run cleanup on startup (uncomment if desired)
     # scheduler.add_job(
-    #     run_cleanup_sync,
+    #     cleanup_old_files,
     #     id="startup_cleanup",
     #     name="Startup Cleanup",
     # )
@@ -116,9 +180,10 @@ def start_scheduler():
     scheduler.start()
     print(f"⏰ Scheduler started - Cleanup runs daily at 00:00 UTC")
     print(f"📅 Data retention period: {DATA_RETENTION_DAYS} days")
+    return True
 
 
 if __name__ == "__main__":
     # For testing: run cleanup immediately
     print("Running cleanup test...")
-    run_cleanup_sync()
+    asyncio.run(cleanup_old_files())
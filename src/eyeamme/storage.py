@@ -1,16 +1,25 @@
 """
 Cloudflare R2 storage module with encryption support.
 """
-import boto3
+from aiobotocore.session import get_session
 from botocore.client import Config
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
+from contextlib import AsyncExitStack, asynccontextmanager
+import asyncio
+import base64
+import hashlib
 import os
-import json
-from typing import Optional, List, Dict
+import uuid
+import orjson
+from datetime import datetime
+from typing import AsyncIterator, Optional, List, Dict, Tuple
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 
-from .config import Settings
-settings = Settings()
+from .config import get_settings
+settings = get_settings()
 
 # R2 Configuration
 # R2_ACCOUNT_ID = os.getenv("R2_ACCOUNT_ID")
@@ -23,34 +32,220 @@ settings = Settings()
 if not all([settings.r2_account_id, settings.r2_access_key_id, settings.r2_secret_access_key, settings.r2_bucket_name]):
     raise ValueError("R2 configuration environment variables are not set")
 
-# Initialize Fernet cipher
-cipher_suite = Fernet(settings.encryption_key.encode() if isinstance(settings.encryption_key, str) else settings.encryption_key)
+# Initialize Fernet cipher (only used to decrypt objects written before AES-GCM)
+encryption_key = settings.encryption_key.encode() if isinstance(settings.encryption_key, str) else settings.encryption_key
+cipher_suite = Fernet(encryption_key)
 
-# Initialize S3 client for R2
-s3_client = boto3.client(
-    "s3",
+# Initialize AES-GCM cipher with a key derived from the Fernet key
+aead = AESGCM(
+    HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"eyeamme-aes-gcm").derive(
+        base64.urlsafe_b64decode(encryption_key)
+    )
+)
+
+# Encrypted blobs are AEAD_VERSION + nonce + ciphertext. Fernet tokens are
+# base64 text starting with "gAAAAA", so the version byte never collides.
+AEAD_VERSION = b"\x01"
+AEAD_NONCE_SIZE = 12
+FERNET_PREFIX = b"gAAAAA"
+AEAD_TAG_SIZE = 16
+
+# Large files are encrypted and uploaded in chunks, one multipart upload part
+# each: AEAD_CHUNKED_VERSION + nonce + ciphertext for every chunk, so all
+# parts but the last are the same size as multipart uploads require. Each
+# chunk's index and whether it is the last one are authenticated, so chunks
+# can't be reordered or dropped.
+AEAD_CHUNKED_VERSION = b"\x02"
+ENCRYPTION_CHUNK_SIZE = 8 * 1024 * 1024
+MULTIPART_CONCURRENCY = 4
+
+# Async S3 client for R2. The app opens one shared client on startup;
+# callers on other event loops get a short-lived one. Its connection pool is
+# sized for concurrent metadata loads and multipart parts, well above the
+# default of 10.
+session = get_session()
+s3_client_kwargs = dict(
     endpoint_url=settings.r2_endpoint_url,
     aws_access_key_id=settings.r2_access_key_id,
     aws_secret_access_key=settings.r2_secret_access_key,
-    config=Config(signature_version="s3v4"),
+    config=Config(
+        signature_version="s3v4",
+        max_pool_connections=64,
+        retries={"mode": "adaptive", "max_attempts": 3},
+    ),
     region_name="auto",
 )
+shared_client = None
+shared_client_loop = None
+shared_client_stack = AsyncExitStack()
+
+# Every user's objects live under users/{user_id}/
+USERS_PREFIX = "users/"
+
+# The users index (email -> user ID) is sharded by email hash so each
+# registration only rewrites a small object
+USERS_INDEX_PREFIX = "users/index/"
+LEGACY_USERS_INDEX_KEY = "users/index.json"
+
+# New file IDs start with their upload day, which is also used as a date
+# bucket in their keys so retention cleanup can decide by key alone
+FILE_DATE_FORMAT = "%Y%m%d"
+
+# Maximum number of keys S3 accepts in one DeleteObjects request
+DELETE_BATCH_SIZE = 1000
+
+# Maximum number of concurrent GETs when loading a user's file metadata
+LOAD_CONCURRENCY = 32
+
+# orjson handles numpy scalars and non-string keys (e.g. numeric column names).
+# Stored JSON is only read by the app, so it isn't indented.
+JSON_OPTIONS = (
+    orjson.OPT_NAIVE_UTC
+    | orjson.OPT_NON_STR_KEYS
+    | orjson.OPT_SERIALIZE_NUMPY
+)
+
+
+def users_index_key(email: str) -> str:
+    """Get the key of the users index shard holding an email."""
+    shard = hashlib.sha256(email.encode("utf-8")).hexdigest()[:2]
+    return f"{USERS_INDEX_PREFIX}{shard}.json"
+
+
+def new_file_id(upload_date: datetime) -> str:
+    """Generate a file ID prefixed with its upload day."""
+    return f"{upload_date.strftime(FILE_DATE_FORMAT)}_{uuid.uuid4()}"
+
+
+def file_upload_day(file_id: str) -> Optional[str]:
+    """Get the upload day (YYYYMMDD) of a file ID, or None for older plain UUIDs."""
+    upload_day, separator, _ = file_id.partition("_")
+    if separator and len(upload_day) == 8 and upload_day.isdigit():
+        return upload_day
+    return None
+
+
+def user_profile_key(user_id: str) -> str:
+    """Get the key of a user's profile."""
+    return f"{USERS_PREFIX}{user_id}/profile.json"
+
+
+def user_files_prefix(user_id: str) -> str:
+    """Get the key prefix holding all of a user's files."""
+    return f"{USERS_PREFIX}{user_id}/files/"
+
+
+def file_prefix(user_id: str, file_id: str) -> str:
+    """Get the key prefix holding a file, its metadata and its report."""
+    upload_day = file_upload_day(file_id)
+    if upload_day is None:
+        return f"{user_files_prefix(user_id)}{file_id}/"
+    return f"{user_files_prefix(user_id)}{upload_day}/{file_id}/"
+
+
+def file_metadata_key(user_id: str, file_id: str) -> str:
+    """Get the key of a file's metadata."""
+    return f"{file_prefix(user_id, file_id)}metadata.json"
+
+
+def file_report_key(user_id: str, file_id: str) -> str:
+    """Get the key of a file's analysis report."""
+    return f"{file_prefix(user_id, file_id)}report.json"
+
+
+def json_default(obj):
+    """Serialize values orjson doesn't support natively, like pandas Timestamps."""
+    if hasattr(obj, "isoformat"):
+        return obj.isoformat()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+async def open_r2_client() -> None:
+    """Open the shared R2 client on the running event loop."""
+    global shared_client, shared_client_loop
+    shared_client = await shared_client_stack.enter_async_context(
+        session.create_client("s3", **s3_client_kwargs)
+    )
+    shared_client_loop = asyncio.get_running_loop()
+
+
+async def close_r2_client() -> None:
+    """Close the shared R2 client."""
+    global shared_client, shared_client_loop
+    await shared_client_stack.aclose()
+    shared_client = None
+    shared_client_loop = None
+
+
+@asynccontextmanager
+async def r2_client() -> AsyncIterator:
+    """Get an R2 client usable on the running event loop."""
+    if shared_client is not None and shared_client_loop is asyncio.get_running_loop():
+        yield shared_client
+    else:
+        async with session.create_client("s3", **s3_client_kwargs) as client:
+            yield client
 
 
 def encrypt_data(data: bytes) -> bytes:
-    """Encrypt data using Fernet encryption."""
-    return cipher_suite.encrypt(data)
+    """Encrypt data using AES-GCM encryption."""
+    nonce = os.urandom(AEAD_NONCE_SIZE)
+    return AEAD_VERSION + nonce + aead.encrypt(nonce, data, None)
+
+
+def chunk_aad(index: int, last: bool) -> bytes:
+    """Get the associated data authenticating a chunk's position."""
+    return AEAD_CHUNKED_VERSION + index.to_bytes(4, "big") + (b"\x01" if last else b"\x00")
+
+
+def encrypt_part(content: bytes, index: int) -> bytes:
+    """Encrypt the chunk of a large file sent as its index-th upload part."""
+    offset = index * ENCRYPTION_CHUNK_SIZE
+    chunk = content[offset:offset + ENCRYPTION_CHUNK_SIZE]
+    last = offset + ENCRYPTION_CHUNK_SIZE >= len(content)
+    nonce = os.urandom(AEAD_NONCE_SIZE)
+    return AEAD_CHUNKED_VERSION + nonce + aead.encrypt(nonce, chunk, chunk_aad(index, last))
+
+
+def is_encrypted(data: bytes) -> bool:
+    """
+    Check whether stored data was encrypted client-side.
+
+    Plain objects are Excel workbooks or JSON, which never start with one of
+    the encrypted formats' markers.
+    """
+    return data[:1] in (AEAD_VERSION, AEAD_CHUNKED_VERSION) or data.startswith(FERNET_PREFIX)
 
 
 def decrypt_data(encrypted_data: bytes) -> bytes:
-    """Decrypt data using Fernet encryption."""
-    return cipher_suite.decrypt(encrypted_data)
+    """Decrypt data encrypted with AES-GCM, or with Fernet by older versions."""
+    if encrypted_data[:1] == AEAD_CHUNKED_VERSION:
+        chunks = memoryview(encrypted_data)
+        encrypted_chunk_size = 1 + AEAD_NONCE_SIZE + ENCRYPTION_CHUNK_SIZE + AEAD_TAG_SIZE
+        offsets = range(0, len(chunks), encrypted_chunk_size)
+        return b"".join(
+            aead.decrypt(
+                chunks[offset + 1:offset + 1 + AEAD_NONCE_SIZE],
+                chunks[offset + 1 + AEAD_NONCE_SIZE:offset + encrypted_chunk_size],
+                chunk_aad(index, index == len(offsets) - 1),
+            )
+            for index, offset in enumerate(offsets)
+        )
+
+    if encrypted_data[:1] != AEAD_VERSION:
+        return cipher_suite.decrypt(encrypted_data)
+
+    nonce = encrypted_data[1:1 + AEAD_NONCE_SIZE]
+    return aead.decrypt(nonce, encrypted_data[1 + AEAD_NONCE_SIZE:], None)
 
 
 async def upload_file_to_r2(key: str, content: bytes) -> bool:
     """
     Upload a file to R2 with encryption.
 
+    Content is encrypted client-side unless CLIENT_SIDE_ENCRYPTION is off,
+    in which case R2 encrypts it at rest instead.
+
     Args:
         key: Object key in R2 bucket
         content: File content as bytes
@@ -59,24 +254,88 @@ async def upload_file_to_r2(key: str, content: bytes) -> bool:
         True if successful, False otherwise
     """
     try:
+        if not settings.client_side_encryption:
+            async with r2_client() as s3_client:
+                await s3_client.put_object(
+                    Bucket=settings.r2_bucket_name,
+                    Key=key,
+                    Body=content,
+                    ServerSideEncryption="AES256",
+                )
+            return True
+
+        # Large files go up in encrypted parts
+        if len(content) > ENCRYPTION_CHUNK_SIZE:
+            await upload_multipart_to_r2(key, content)
+            return True
+
         # Encrypt content
         encrypted_content = encrypt_data(content)
 
         # Upload to R2
-        s3_client.put_object(
-            Bucket=settings.r2_bucket_name,
-            Key=key,
-            Body=encrypted_content,
-        )
+        async with r2_client() as s3_client:
+            await s3_client.put_object(
+                Bucket=settings.r2_bucket_name,
+                Key=key,
+                Body=encrypted_content,
+            )
         return True
-    except ClientError as e:
+    except (ClientError, BotoCoreError) as e:
         print(f"Error uploading to R2: {e}")
         return False
 
 
+async def upload_multipart_to_r2(key: str, content: bytes) -> None:
+    """
+    Upload a large file to R2 with encryption, as a multipart upload.
+
+    Every part is encrypted separately just before it is sent, so only the
+    parts in flight are held encrypted in memory instead of a full copy.
+
+    Args:
+        key: Object key in R2 bucket
+        content: File content as bytes
+    """
+    content_view = memoryview(content)
+    part_count = -(-len(content) // ENCRYPTION_CHUNK_SIZE)
+    semaphore = asyncio.Semaphore(MULTIPART_CONCURRENCY)
+
+    async with r2_client() as s3_client:
+        upload = await s3_client.create_multipart_upload(
+            Bucket=settings.r2_bucket_name, Key=key
+        )
+
+        async def upload_part(index: int) -> dict:
+            async with semaphore:
+                response = await s3_client.upload_part(
+                    Bucket=settings.r2_bucket_name,
+                    Key=key,
+                    UploadId=upload["UploadId"],
+                    PartNumber=index + 1,
+                    Body=encrypt_part(content_view, index),
+                )
+                return {"ETag": response["ETag"], "PartNumber": index + 1}
+
+        try:
+            parts = await asyncio.gather(
+                *(upload_part(index) for index in range(part_count))
+            )
+            await s3_client.complete_multipart_upload(
+                Bucket=settings.r2_bucket_name,
+                Key=key,
+                UploadId=upload["UploadId"],
+                MultipartUpload={"Parts": parts},
+            )
+        except Exception:
+            await s3_client.abort_multipart_upload(
+                Bucket=settings.r2_bucket_name, Key=key, UploadId=upload["UploadId"]
+            )
+            raise
+
+
 async def download_file_from_r2(key: str) -> Optional[bytes]:
     """
-    Download and decrypt a file from R2.
+    Download a file from R2, decrypting it if it was encrypted client-side.
 
     Args:
         key: Object key in R2 bucket
@@ -85,11 +344,17 @@ async def download_file_from_r2(key: str) -> Optional[bytes]:
         Decrypted file content as bytes, or None if not found
     """
     try:
-        response = s3_client.get_object(Bucket=settings.r2_bucket_name, Key=key)
-        encrypted_content = response["Body"].read()
+        async with r2_client() as s3_client:
+            response = await s3_client.get_object(Bucket=settings.r2_bucket_name, Key=key)
+            async with response["Body"] as body:
+                content = await body.read()
+
+        # Objects stored with server-side encryption only are plain
+        if not is_encrypted(content):
+            return content
 
         # Decrypt content
-        decrypted_content = decrypt_data(encrypted_content)
+        decrypted_content = decrypt_data(content)
         return decrypted_content
     except ClientError as e:
         if e.response["Error"]["Code"] == "NoSuchKey":
@@ -109,13 +374,42 @@ async def delete_file_from_r2(key: str) -> bool:
         True if successful, False otherwise
     """
     try:
-        s3_client.delete_object(Bucket=settings.r2_bucket_name, Key=key)
+        async with r2_client() as s3_client:
+            await s3_client.delete_object(Bucket=settings.r2_bucket_name, Key=key)
         return True
     except ClientError as e:
         print(f"Error deleting from R2: {e}")
         return False
 
 
+async def delete_objects_from_r2(keys: List[str]) -> bool:
+    """
+    Delete several objects from R2 with batched DeleteObjects requests.
+
+    Args:
+        keys: Object keys in R2 bucket
+
+    Returns:
+        True if every object was deleted, False otherwise
+    """
+    success = True
+    async with r2_client() as s3_client:
+        for start in range(0, len(keys), DELETE_BATCH_SIZE):
+            batch = keys[start:start + DELETE_BATCH_SIZE]
+            try:
+                response = await s3_client.delete_objects(
+                    Bucket=settings.r2_bucket_name,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+                for error in response.get("Errors", []):
+                    print(f"Error deleting {error['Key']} from R2: {error['Message']}")
+                    success = False
+            except ClientError as e:
+                print(f"Error deleting from R2: {e}")
+                success = False
+    return success
+
+
 async def list_objects_with_prefix(prefix: str) -> List[str]:
     """
     List all object keys with a given prefix.
@@ -127,30 +421,49 @@ async def list_objects_with_prefix(prefix: str) -> List[str]:
         List of object keys
     """
     try:
-        response = s3_client.list_objects_v2(Bucket=settings.r2_bucket_name, Prefix=prefix)
-        if "Contents" not in response:
-            return []
-
-        return [obj["Key"] for obj in response["Contents"]]
+        keys = []
+        async with r2_client() as s3_client:
+            paginator = s3_client.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(
+                Bucket=settings.r2_bucket_name,
+                Prefix=prefix,
+                PaginationConfig={"PageSize": 1000},
+            ):
+                keys.extend(obj["Key"] for obj in page.get("Contents", []))
+
+        return keys
     except ClientError as e:
         print(f"Error listing objects in R2: {e}")
         return []
 
 
-async def save_json_to_r2(key: str, data: dict) -> bool:
+async def save_json_to_r2(key: str, data: dict, encrypt: bool = True) -> bool:
     """
     Save a JSON object to R2 with encryption.
 
     Args:
         key: Object key in R2 bucket
         data: Dictionary to save as JSON
+        encrypt: Whether to encrypt client-side. Non-sensitive objects can
+            skip it and rely on R2's server-side encryption instead.
 
     Returns:
         True if successful, False otherwise
     """
     try:
-        json_content = json.dumps(data, indent=2).encode("utf-8")
-        return await upload_file_to_r2(key, json_content)
+        json_content = orjson.dumps(data, default=json_default, option=JSON_OPTIONS)
+        if encrypt and settings.client_side_encryption:
+            return await upload_file_to_r2(key, json_content)
+
+        async with r2_client() as s3_client:
+            await s3_client.put_object(
+                Bucket=settings.r2_bucket_name,
+                Key=key,
+                Body=json_content,
+                ContentType="application/json",
+                ServerSideEncryption="AES256",
+            )
+        return True
     except Exception as e:
         print(f"Error saving JSON to R2: {e}")
         return False
@@ -158,7 +471,7 @@ async def save_json_to_r2(key: str, data: dict) -> bool:
 
 async def load_json_from_r2(key: str) -> Optional[dict]:
     """
-    Load a JSON object from R2 with decryption.
+    Load a JSON object from R2, decrypting it if it was stored encrypted.
 
     Args:
         key: Object key in R2 bucket
@@ -171,12 +484,77 @@ async def load_json_from_r2(key: str) -> Optional[dict]:
         if content is None:
             return None
 
-        return json.loads(content.decode("utf-8"))
+        return orjson.loads(content)
     except Exception as e:
         print(f"Error loading JSON from R2: {e}")
         return None
 
 
+async def load_json_with_etag_from_r2(key: str) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Load a JSON object from R2 along with its ETag.
+
+    Args:
+        key: Object key in R2 bucket
+
+    Returns:
+        Tuple of (parsed dictionary, ETag), or (None, None) if not found
+    """
+    try:
+        async with r2_client() as s3_client:
+            response = await s3_client.get_object(Bucket=settings.r2_bucket_name, Key=key)
+            async with response["Body"] as body:
+                content = await body.read()
+        if is_encrypted(content):
+            content = decrypt_data(content)
+        return orjson.loads(content), response["ETag"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchKey":
+            print(f"Error loading JSON from R2: {e}")
+        return None, None
+    except Exception as e:
+        print(f"Error loading JSON from R2: {e}")
+        return None, None
+
+
+async def save_json_to_r2_if_match(key: str, data: dict, etag: Optional[str]) -> bool:
+    """
+    Save a JSON object to R2 only if it hasn't changed since it was read.
+
+    Args:
+        key: Object key in R2 bucket
+        data: Dictionary to save as JSON
+        etag: ETag the object had when read, or None if it didn't exist
+
+    Returns:
+        True if successful, False if the object changed meanwhile or on error
+    """
+    conditions = {"IfMatch": etag} if etag else {"IfNoneMatch": "*"}
+    try:
+        json_content = orjson.dumps(data, default=json_default, option=JSON_OPTIONS)
+        if settings.client_side_encryption:
+            body, encryption = encrypt_data(json_content), {}
+        else:
+            body, encryption = json_content, {"ServerSideEncryption": "AES256"}
+
+        async with r2_client() as s3_client:
+            await s3_client.put_object(
+                Bucket=settings.r2_bucket_name,
+                Key=key,
+                Body=body,
+                **conditions,
+                **encryption,
+            )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("PreconditionFailed", "ConditionalRequestConflict"):
+            print(f"Error saving JSON to R2: {e}")
+        return False
+    except Exception as e:
+        print(f"Error saving JSON to R2: {e}")
+        return False
+
+
 async def list_user_files(user_id: str) -> List[Dict]:
     """
     List all files uploaded by a specific user.
@@ -189,18 +567,21 @@ async def list_user_files(user_id: str) -> List[Dict]:
     """
     try:
         # List all metadata files for this user
-        prefix = f"users/{user_id}/files/"
+        prefix = user_files_prefix(user_id)
         keys = await list_objects_with_prefix(prefix)
 
         # Filter for metadata.json files
         metadata_keys = [key for key in keys if key.endswith("/metadata.json")]
 
-        # Load all metadata
-        files = []
-        for metadata_key in metadata_keys:
-            metadata = await load_json_from_r2(metadata_key)
-            if metadata:
-                files.append(metadata)
+        # Load all metadata concurrently, with a bounded number of requests
+        semaphore = asyncio.Semaphore(LOAD_CONCURRENCY)
+
+        async def load_metadata(metadata_key: str) -> Optional[dict]:
+            async with semaphore:
+                return await load_json_from_r2(metadata_key)
+
+        results = await asyncio.gather(*map(load_metadata, metadata_keys))
+        files = [metadata for metadata in results if metadata]
 
         # Sort by upload date (most recent first)
         files.sort(key=lambda x: x.get("upload_date", ""), reverse=True)
@@ -211,7 +592,45 @@ async def list_user_files(user_id: str) -> List[Dict]:
         return []
 
 
-async def delete_user_file(user_id: str, file_id: str) -> bool:
+def group_file_keys(user_id: str, keys: List[str]) -> Dict[str, List[str]]:
+    """
+    Group the keys under a user's files prefix by the file they belong to.
+
+    Args:
+        user_id: User's unique identifier
+        keys: Object keys under the user's files prefix
+
+    Returns:
+        Dictionary mapping file IDs to their object keys
+    """
+    prefix = user_files_prefix(user_id)
+    file_keys = {}
+    for key in keys:
+        parts = key[len(prefix):].split("/")
+        # Date-bucketed keys have an extra path component before the file ID
+        if len(parts) > 2 and file_upload_day(parts[1]) == parts[0]:
+            file_id = parts[1]
+        else:
+            file_id = parts[0]
+        file_keys.setdefault(file_id, []).append(key)
+    return file_keys
+
+
+async def list_user_file_keys(user_id: str) -> Dict[str, List[str]]:
+    """
+    List the keys of all files uploaded by a user, without loading metadata.
+
+    Args:
+        user_id: User's unique identifier
+
+    Returns:
+        Dictionary mapping file IDs to their object keys
+    """
+    keys = await list_objects_with_prefix(user_files_prefix(user_id))
+    return group_file_keys(user_id, keys)
+
+
+async def delete_user_file(user_id: str, file_id: str) -> Optional[bool]:
     """
     Delete all data associated with a file (file, metadata, report).
 
@@ -220,25 +639,21 @@ async def delete_user_file(user_id: str, file_id: str) -> bool:
         file_id: File's unique identifier
 
     Returns:
-        True if successful, False otherwise
+        True if successful, None if the file was not found, False otherwise
     """
     try:
         # Get metadata to find file key
-        metadata_key = f"users/{user_id}/files/{file_id}/metadata.json"
+        metadata_key = file_metadata_key(user_id, file_id)
         metadata = await load_json_from_r2(metadata_key)
 
         if metadata is None:
-            return False
+            return None
 
         # Delete all associated files
         file_key = metadata["file_key"]
-        report_key = f"users/{user_id}/files/{file_id}/report.json"
-
-        await delete_file_from_r2(file_key)
-        await delete_file_from_r2(metadata_key)
-        await delete_file_from_r2(report_key)
+        report_key = file_report_key(user_id, file_id)
 
-        return True
+        return await delete_objects_from_r2([file_key, metadata_key, report_key])
     except Exception as e:
         print(f"Error deleting user file: {e}")
         return False
@@ -246,17 +661,40 @@ async def delete_user_file(user_id: str, file_id: str) -> bool:
 
 async def get_all_user_ids() -> List[str]:
     """
-    Get all user IDs from the users index.
+    Get all user IDs from the per-user key prefixes.
+
+    Falls back to the users index shards if there are no user prefixes.
 
     Returns:
         List of user IDs
     """
     try:
-        users_index = await load_json_from_r2("users/index.json")
-        if users_index is None:
-            return []
-
-        return list(users_index["users"].values())
+        user_ids = []
+        async with r2_client() as s3_client:
+            paginator = s3_client.get_paginator("list_objects_v2")
+            async for page in paginator.paginate(
+                Bucket=settings.r2_bucket_name,
+                Prefix=USERS_PREFIX,
+                Delimiter="/",
+            ):
+                for common_prefix in page.get("CommonPrefixes", []):
+                    if common_prefix["Prefix"] != USERS_INDEX_PREFIX:
+                        user_ids.append(common_prefix["Prefix"][len(USERS_PREFIX):-1])
+
+        if user_ids:
+            return user_ids
+
+        # Fall back to the users index
+        index_keys = await list_objects_with_prefix(USERS_INDEX_PREFIX)
+        index_keys.append(LEGACY_USERS_INDEX_KEY)
+
+        user_ids = set()
+        for index_key in index_keys:
+            users_index = await load_json_from_r2(index_key)
+            if users_index:
+                user_ids.update(users_index["users"].values())
+
+        return list(user_ids)
     except Exception as e:
         print(f"Error getting user IDs: {e}")
         return []
@@ -0,0 +1,18 @@
+from io import BytesIO
+
+import pandas as pd
+from eyeamme.analysis import analyze_excel
+
+
+def test_analyze_sheet_with_mixed_type_column():
+    workbook = BytesIO()
+    pd.DataFrame({"mixed": [1, "a", 2.5], "number": [1, 2, 3]}).to_excel(workbook, index=False)
+    workbook.seek(0)
+
+    result = analyze_excel(workbook)
+
+    assert "error" not in result
+    assert result["summary"]["total_rows"] == 3
+    assert result["data_preview"]["first_5_rows"][1]["mixed"] == "a"
+    assert list(result["statistics"]) == ["number"]
+    assert result["statistics"]["number"]["median"] == 2
@@ -1,6 +1,6 @@
 import pytest
 from pathlib import Path
-from eyeamme.config import Settings
+from eyeamme.config import Settings, get_settings
 
 
 def test_settings_from_environment_var(monkeypatch):
@@ -22,6 +22,22 @@ def test_settings_from_environment_var(monkeypatch):
     Settings()
 
 
+def test_get_settings_is_cached(monkeypatch):
+    monkeypatch.setenv("R2_ACCOUNT_ID", "8372c198a6857d1a119ee13add9dfb5b")
+    monkeypatch.setenv("R2_ACCESS_KEY_ID", "28192e5f84464b5302da77bac2a88685")
+    monkeypatch.setenv("R2_SECRET_ACCESS_KEY", "d6ff8952545360a7481626b03fa49aa9d0fd76c761875e4572ed40316be92765")
+    monkeypatch.setenv("R2_BUCKET_NAME", "eyeamme")
+    monkeypatch.setenv("R2_ENDPOINT_URL", "https://8372c198a6857d1a119ee13add9dfb5b.r2.cloudflarestorage.com")
+    monkeypatch.setenv("SECRET_KEY", "cfb7cbef358e6fdfa37a1b5bbdc0df51d6fcd32d518b93de4000186507361f96")
+    monkeypatch.setenv("ENCRYPTION_KEY", "Hj6vCNVu39O4RJtHhQ61eMTgMc-M3UOYVKlGJoo_biM=")
+
+    get_settings.cache_clear()
+    try:
+        assert get_settings() is get_settings()
+    finally:
+        get_settings.cache_clear()
+
+
 def test_settings_from_environment_file(tmp_path: Path):
     temp_dotenv_file = tmp_path.joinpath(".env.tmp")
     temp_dotenv_file.write_text("""
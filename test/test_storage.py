@@ -0,0 +1,100 @@
+import importlib
+from datetime import datetime, timezone
+
+import pytest
+from eyeamme.config import get_settings
+
+
+ENVIRONMENT = {
+    "R2_ACCOUNT_ID": "8372c198a6857d1a119ee13add9dfb5b",
+    "R2_ACCESS_KEY_ID": "28192e5f84464b5302da77bac2a88685",
+    "R2_SECRET_ACCESS_KEY": "d6ff8952545360a7481626b03fa49aa9d0fd76c761875e4572ed40316be92765",
+    "R2_BUCKET_NAME": "eyeamme",
+    "R2_ENDPOINT_URL": "https://8372c198a6857d1a119ee13add9dfb5b.r2.cloudflarestorage.com",
+    "SECRET_KEY": "cfb7cbef358e6fdfa37a1b5bbdc0df51d6fcd32d518b93de4000186507361f96",
+    "ENCRYPTION_KEY": "Hj6vCNVu39O4RJtHhQ61eMTgMc-M3UOYVKlGJoo_biM=",
+}
+
+
+@pytest.fixture(scope="module")
+def storage():
+    # storage reads its settings on import
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        for name, value in ENVIRONMENT.items():
+            monkeypatch.setenv(name, value)
+        get_settings.cache_clear()
+        try:
+            yield importlib.import_module("eyeamme.storage")
+        finally:
+            get_settings.cache_clear()
+
+
+def test_aes_gcm_round_trip(storage):
+    data = b"some workbook bytes"
+    encrypted = storage.encrypt_data(data)
+
+    assert encrypted[:1] == storage.AEAD_VERSION
+    assert storage.is_encrypted(encrypted)
+    assert storage.decrypt_data(encrypted) == data
+
+
+def test_decrypt_legacy_fernet_token(storage):
+    token = storage.cipher_suite.encrypt(b'{"users": {}}')
+
+    assert storage.is_encrypted(token)
+    assert storage.decrypt_data(token) == b'{"users": {}}'
+
+
+@pytest.mark.parametrize(
+    "data",
+    [b"PK\x03\x04workbook", b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1workbook", b'{"file_id": "x"}'],
+    ids=["xlsx", "xls", "json"],
+)
+def test_plain_data_is_not_encrypted(storage, data):
+    assert not storage.is_encrypted(data)
+
+
+def test_new_file_id_carries_upload_day(storage):
+    file_id = storage.new_file_id(datetime(2026, 10, 15, 23, 59, tzinfo=timezone.utc))
+
+    assert file_id.startswith("20261015_")
+    assert storage.file_upload_day(file_id) == "20261015"
+    assert storage.file_prefix("u1", file_id) == f"users/u1/files/20261015/{file_id}/"
+
+
+def test_legacy_uuid_file_id_has_no_upload_day(storage):
+    # Some UUIDs start with eight digits, which must not be taken for a day
+    for file_id in ["6f1c2a9e-4b7d-4c1e-9a3b-2d5e8f0a1b2c", "20261015-4b7d-4c1e-9a3b-2d5e8f0a1b2c"]:
+        assert storage.file_upload_day(file_id) is None
+        assert storage.file_prefix("u1", file_id) == f"users/u1/files/{file_id}/"
+
+
+def test_group_file_keys_by_file_id(storage):
+    bucketed_id = "20261015_4b7d4c1e-9a3b-2d5e-8f0a-1b2c6f1c2a9e"
+    legacy_id = "6f1c2a9e-4b7d-4c1e-9a3b-2d5e8f0a1b2c"
+    bucketed = [
+        f"users/u1/files/20261015/{bucketed_id}/metadata.json",
+        f"users/u1/files/20261015/{bucketed_id}/report.json",
+        f"users/u1/files/20261015/{bucketed_id}/book.xlsx",
+    ]
+    legacy = [
+        f"users/u1/files/{legacy_id}/metadata.json",
+        f"users/u1/files/{legacy_id}/old.xlsx",
+    ]
+
+    assert storage.group_file_keys("u1", bucketed + legacy) == {
+        bucketed_id: bucketed,
+        legacy_id: legacy,
+    }
+
+
+def test_multipart_parts_round_trip(storage, monkeypatch):
+    monkeypatch.setattr(storage, "ENCRYPTION_CHUNK_SIZE", 1024)
+    data = bytes(range(256)) * 10
+
+    parts = [storage.encrypt_part(data, index) for index in range(3)]
+
+    # Multipart uploads need every part but the last to be the same size
+    assert len(parts[0]) == len(parts[1]) > len(parts[2])
+    assert storage.is_encrypted(b"".join(parts))
+    assert storage.decrypt_data(b"".join(parts)) == data